@@ -1,17 +1,18 @@
+import json
 import logging
 import os
 import re
 import shutil
 import sys
 import time
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import unquote, urlparse
-from urllib.request import urlopen
 
 import chime
 import pyperclip
+import urllib3
 from dotenv import load_dotenv
-from PIL import Image
+from PIL import ImageFile
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
@@ -29,14 +30,50 @@ logging.basicConfig(
 
 load_dotenv()
 
-current_folder = os.path.dirname(os.path.realpath(__file__))
+current_folder = os.path.dirname(os.path.abspath(__file__))
 cookie_file_path = os.path.join(current_folder, "cookies.json")
 screenshot_folder = os.path.join(current_folder, "screenshots")
-os.makedirs(screenshot_folder, exist_ok=True)
 cover_folder = os.path.join(current_folder, "covers")
-os.makedirs(cover_folder, exist_ok=True)
-ff_profile_folder = os.path.join(current_folder, "ff_profile")
-os.makedirs(ff_profile_folder, exist_ok=True)
+for folder in (screenshot_folder, cover_folder):
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+harmony_url = "https://harmony.pulsewidth.org.uk/"
+cover_art_count_pattern = re.compile(r"Cover art \((\d+)\)")
+
+# Returns the input id, pre-entered value, search button and remove button of
+# every label in a release event fieldset
+release_labels_script = """
+const fieldset = arguments[0];
+const removeButtons = fieldset.getElementsByClassName("remove-release-label");
+return Array.from(fieldset.querySelectorAll("span.autocomplete")).map((el, i) => {
+    const input = el.querySelector("input");
+    return {
+        inputId: input ? input.id : null,
+        value: input ? input.value : null,
+        searchButton: el.querySelector("img"),
+        removeButton: removeButtons[i] || null,
+    };
+});
+"""
+
+# Returns the first result of a visible label search list together with its
+# own text, or null while the results are loading
+first_label_result_script = """
+const list = arguments[0];
+if ((list.getAttribute("style") || "").toLowerCase().includes("display: none")) {
+    return null;
+}
+const link = list.querySelector("li:first-of-type a");
+if (!link) {
+    return null;
+}
+const text = Array.from(link.childNodes)
+    .filter(n => n.nodeType === Node.TEXT_NODE)
+    .map(n => n.textContent)
+    .join("");
+return [link, text];
+"""
 
 
 class HarmonyDriver:
@@ -49,6 +86,7 @@ class HarmonyDriver:
         manual_label_selection: bool,
         use_test_mb: bool,
         song_urls: list[str],
+        headless: bool = False,
     ):
         self.pause_on_found_release = pause_on_found_release
         self.manual_review_before_publish = manual_review_before_publish
@@ -57,15 +95,47 @@ class HarmonyDriver:
         self.manual_label_selection = manual_label_selection
         self.use_test_mb = use_test_mb
         self.song_urls = song_urls
+        # Without any of these the run is unattended and prompts that only
+        # guard against unexpected states are answered automatically
+        self.interactive = (
+            pause_on_found_release
+            or manual_review_before_publish
+            or manual_label_selection
+        )
 
         self.harmony_tab: str | None = None
         self.processing_tab: str
 
+        # Shared by all cover art requests so connections to the image hosts
+        # are kept alive across candidates and albums
+        self.http = urllib3.PoolManager(
+            num_pools=8,
+            maxsize=16,
+            headers=urllib3.make_headers(accept_encoding=True),
+        )
+
         options = Options()
-        options.profile = ff_profile_folder
+        # Nothing needs to be seen when the run is fully automated
+        fully_automated = (
+            not self.interactive
+            and bool(os.getenv("mb_user"))
+            and bool(os.getenv("mb_pass"))
+        )
+        if headless and (manual_review_before_publish or manual_label_selection):
+            logging.warning(
+                "Running headless with manual review or manual label selection, "
+                "the pages to review will not be visible"
+            )
+        if headless or fully_automated:
+            logging.info("Running Firefox in headless mode")
+            options.add_argument("--headless")
+        # Images are never needed by the browser itself, cover art is fetched
+        # separately from its URL
+        options.set_preference("permissions.default.image", 2)
+        options.set_preference("privacy.trackingprotection.enabled", True)
 
         self.driver = webdriver.Firefox(options=options)
-        self.driver.implicitly_wait(10)
+        self.load_cookies()
 
     def process(self):
         logging.info(f"Starting Harmony processing of {len(self.song_urls)} albums.")
@@ -73,7 +143,13 @@ class HarmonyDriver:
         for i, song_url in enumerate(self.song_urls, start=1):
             logging.info(f"Processing album {i}/{len(self.song_urls)}")
             logging.info(f"Album URL: {song_url}")
-            self.process_harmony(song_url)
+            try:
+                self.process_harmony(song_url)
+            except Exception:
+                if self.interactive:
+                    raise
+                logging.exception(f"Failed to process album {song_url}, skipping")
+                self.close_tabs_except_harmony()
         logging.info(f"Done processing {len(self.song_urls)} albums.")
         chime.success()
 
@@ -81,40 +157,64 @@ class HarmonyDriver:
         if self.harmony_tab is not None:
             self.driver.switch_to.window(self.harmony_tab)
 
-        logging.info("Open Harmony")
-        self.driver.get("https://harmony.pulsewidth.org.uk/")
-        self.harmony_tab = self.driver.current_window_handle
+        # Every Harmony page has the lookup form, so the previous album's page
+        # can be reused without navigating back to the start page
+        if self.harmony_tab is None or not self.driver.current_url.startswith(
+            harmony_url
+        ):
+            logging.info("Open Harmony")
+            self.driver.get(harmony_url)
+            self.harmony_tab = self.driver.current_window_handle
+        else:
+            logging.info("Reusing Harmony tab")
 
         logging.info("Enable MusicBrainz provider")
-        self.driver.find_element(By.ID, "musicbrainz-input").click()
+        musicbrainz_input = self.wait_find_element(By.ID, "musicbrainz-input", 2)
+        if not musicbrainz_input.is_selected():
+            musicbrainz_input.click()
 
         logging.info(f"Submitting album URL: {song_url}")
-        provider_url = self.wait_find_element(By.ID, "url-input")
+        provider_url = self.wait_find_element(By.ID, "url-input", 2)
         provider_url.clear()
         provider_url.send_keys(song_url)
         logging.info("Submitting form")
         provider_url.submit()
-        time.sleep(1.5)
 
         logging.info("Waiting for page to update")
-        logging.info("Find import button")
-        import_button = self.wait_find_element(
-            By.XPATH, "//input[@type='submit' and @value='Import into MusicBrainz']", 10
+        try:
+            WebDriverWait(self.driver, 10).until(EC.staleness_of(provider_url))
+        except TimeoutException:
+            # Slow provider lookups are left to the element waits below,
+            # which prompt for a retry
+            pass
+        import_locator = (
+            By.XPATH,
+            "//input[@type='submit' and @value='Import into MusicBrainz']",
         )
+        # Look for the message itself rather than serializing the whole page
+        already_linked_locator = (
+            By.XPATH,
+            "//*[text()[contains(., 'is already linked to this')"
+            " or contains(., 'already exists on MusicBrainz')]]",
+        )
+        try:
+            # Return as soon as either outcome has rendered
+            WebDriverWait(self.driver, 10).until(
+                EC.any_of(
+                    EC.presence_of_element_located(import_locator),
+                    EC.presence_of_element_located(already_linked_locator),
+                )
+            )
+        except TimeoutException:
+            pass
         update_release = False
         logging.info("Check if album already exists")
-        page_text = self.driver.find_element(By.TAG_NAME, "body").text
-        if (
-            "is already linked to this" in page_text
-            or "already exists on MusicBrainz" in page_text
-        ):
+        already_linked = self.driver.find_elements(*already_linked_locator)
+        if already_linked:
             logging.info("Album already linked to MusicBrainz release")
-            user_input = (
-                input(
-                    "!!! Do you want to update external links? Press 's' skip or 'c' to continue: "
-                )
-                .strip()
-                .lower()
+            user_input = self.ask(
+                "!!! Do you want to update external links? Press 's' skip or 'c' to continue: ",
+                "s",
             )
             if user_input != "c":
                 link = self.driver.find_element(
@@ -129,7 +229,6 @@ class HarmonyDriver:
                 if self.pause_on_found_release:
                     chime.info()
                     input("!!! Press Enter to continue to the next album...")
-                self.driver.close()
                 return
             else:
                 logging.info("Change to update button")
@@ -141,7 +240,10 @@ class HarmonyDriver:
                 )
         else:
             logging.info("Album not yet linked, proceeding with import")
+            logging.info("Find import button")
+            import_button = self.wait_find_element(*import_locator, 2)
         if self.use_test_mb:
+            # Points the import form of the Harmony release page to the test server
             logging.info("Modifying MusicBrainz links to use test server")
             self.modify_musicbrainz_links()
 
@@ -155,6 +257,8 @@ class HarmonyDriver:
             return
 
         if self.use_test_mb:
+            # The processing tab is now on Harmony's release actions page,
+            # whose links need the same rewrite
             logging.info("Modifying MusicBrainz links to use test server")
             self.modify_musicbrainz_links()
             logging.info("Skipping ISRC submission in test MB mode")
@@ -167,6 +271,7 @@ class HarmonyDriver:
             elem = self.wait_find_element(
                 By.XPATH,
                 '//li[@data-provider="MusicBrainz"]//a[contains(@class,"provider-id")]',
+                2,
             )
             logging.info(f"Copying MusicBrainz release ID to clipboard: {elem.text}")
             pyperclip.copy(elem.text)
@@ -197,12 +302,16 @@ class HarmonyDriver:
                     raise SystemExit(
                         "MusicBrainz username or password environment variables are not set."
                     )
-                self.wait_find_element(By.ID, "id-username").send_keys(mb_user)
-                self.wait_find_element(By.ID, "id-password").send_keys(mb_pass)
-                remember_me = self.wait_find_element(By.ID, "id-remember_me")
+                self.wait_find_element(By.ID, "id-username", 2).send_keys(mb_user)
+                self.wait_find_element(By.ID, "id-password", 2).send_keys(mb_pass)
+                remember_me = self.wait_find_element(By.ID, "id-remember_me", 2)
                 remember_me.click()
                 remember_me.submit()
             else:
+                if not self.interactive:
+                    logging.warning(
+                        "No MusicBrainz credentials set, waiting for a manual login"
+                    )
                 chime.info()
                 input(
                     "!!! Press Enter after you are done logging into MusicBrainz. Remember the check 'Keep me logged in'"
@@ -216,32 +325,52 @@ class HarmonyDriver:
             By.XPATH, "//a[normalize-space() = 'Edit note']"
         )
         if new_login:
-            logging.info("Saving Firefox profile after login to MusicBrainz")
-            self.save_profile()
+            logging.info("Saving cookies after login to MusicBrainz")
+            self.save_cookies()
         edit_note_button.click()
 
-        time.sleep(0.5)
         if update_release:
+            # The tab links to its panel, which has to be shown before its
+            # messages can be trusted
+            edit_note_panel = urlparse(
+                edit_note_button.get_attribute("href") or ""
+            ).fragment
+            if edit_note_panel:
+                try:
+                    WebDriverWait(self.driver, 2).until(
+                        EC.visibility_of_element_located((By.ID, edit_note_panel))
+                    )
+                except TimeoutException:
+                    pass
             logging.info("Check if any changes were made to the release")
-            form_text = self.driver.find_element(By.ID, "form").text
-            if "You haven’t made any changes!" in form_text:
+            no_changes = self.driver.find_elements(
+                By.XPATH,
+                "//*[@id='form']//*[text()[contains(., 'You haven’t made any changes!')]]",
+            )
+            # The release editor keeps hidden messages in the DOM
+            if any(e.is_displayed() for e in no_changes):
                 logging.info("No changes made to the release, skipping update.")
                 self.driver.close()
                 return False
         else:
             logging.info("Check for release duplicates")
             li_locator = "//li[a[normalize-space(text())='Release duplicates']]"
-            li = self.wait_find_element(By.XPATH, li_locator)
+            li = self.wait_find_element(By.XPATH, li_locator, 2)
             logging.info("Checking if duplicates found")
-            time.sleep(1)
+            try:
+                # A disabled tab can also mean the duplicate search is still
+                # running, so only an enabled tab ends the wait early. Otherwise
+                # the search gets the full grace period before it is trusted.
+                WebDriverWait(self.driver, 1).until(
+                    lambda d: li.get_attribute("aria-disabled") is None
+                )
+            except TimeoutException:
+                pass
             if li.get_attribute("aria-disabled") is None:
                 chime.info()
-                user_input = (
-                    input(
-                        "!!! Possible duplicate releases found, please review! Press 's' skip this release or 'c' to continue: "
-                    )
-                    .strip()
-                    .lower()
+                user_input = self.ask(
+                    "!!! Possible duplicate releases found, please review! Press 's' skip this release or 'c' to continue: ",
+                    "s",
                 )
                 if user_input != "c":
                     self.driver.close()
@@ -250,15 +379,15 @@ class HarmonyDriver:
                 edit_note_button.click()
 
         logging.info("Look for errors")
-        error_tabs = []
-        try:
-            error_tabs = self.driver.find_elements(By.CLASS_NAME, "error-tab")
-            logging.info(f"Errors found: {len(error_tabs)}")
-        except Exception:
-            pass
+        error_tabs = self.driver.find_elements(By.CLASS_NAME, "error-tab")
+        logging.info(f"Errors found: {len(error_tabs)}")
 
         if len(error_tabs) >= 2:
             logging.info("Multiple errors found, manual intervention required")
+            if not self.interactive:
+                logging.warning("Cannot fix multiple errors unattended, skipping")
+                self.driver.close()
+                return False
             chime.info()
             input(
                 "!!! Multiple errors detected, please take care of them manually and then press enter."
@@ -266,77 +395,81 @@ class HarmonyDriver:
         elif len(error_tabs) == 1:
             logging.info("Single error found, attempting to fix")
             error_tabs[0].click()
-            time.sleep(0.5)  # wait for tab content to load
-            page_text = self.driver.find_element(By.TAG_NAME, "body").text
-            if "You haven’t selected a label for" in page_text:
+            release_event_locator = (
+                By.XPATH,
+                "//fieldset[legend[normalize-space(.)='Release event']]",
+            )
+            try:
+                # wait for tab content to load
+                WebDriverWait(self.driver, 2).until(
+                    EC.visibility_of_element_located(release_event_locator)
+                )
+            except TimeoutException:
+                pass
+            missing_label = self.driver.find_elements(
+                By.XPATH,
+                "//*[text()[contains(., 'You haven’t selected a label for')]]",
+            )
+            if any(e.is_displayed() for e in missing_label):
                 logging.info("Fetch release event fieldset")
                 release_event_fieldset = self.wait_find_element(
-                    By.XPATH, "//fieldset[legend[normalize-space(.)='Release event']]"
+                    *release_event_locator, 2
                 )
                 logging.info("Fixing missing label error")
-                label_search_list = release_event_fieldset.find_elements(
-                    By.CSS_SELECTOR, "span.autocomplete"
-                )
-                remove_label_list = release_event_fieldset.find_elements(
-                    By.CLASS_NAME, "remove-release-label"
+                # Gather everything needed per label in a single round-trip
+                labels: list[dict] = self.driver.execute_script(
+                    release_labels_script, release_event_fieldset
                 )
-                for i, label_search in enumerate(label_search_list):
-                    logging.info(
-                        f"Trying to fix label {i + 1}/{len(label_search_list)}"
-                    )
-                    search_input = label_search.find_element(By.CSS_SELECTOR, "input")
-                    logging.info("Find search button")
-                    search_button = label_search.find_element(By.CSS_SELECTOR, "img")
+                for i, label in enumerate(labels):
+                    logging.info(f"Trying to fix label {i + 1}/{len(labels)}")
+                    pre_entered_text = label["value"]
+                    if pre_entered_text is None:
+                        logging.info("Pre-entered label text is empty, cannot match")
+                        continue
+
                     logging.info("Click label search")
-                    search_button.click()
+                    # The search button is an image, which has no size while
+                    # image loading is disabled
+                    self.driver.execute_script(
+                        "arguments[0].click();", label["searchButton"]
+                    )
 
                     logging.info("Find correct search list")
                     search_list = self.wait_find_element(
                         By.CSS_SELECTOR,
-                        f'ul[data-input-id="{search_input.get_attribute("id")}"]',
-                    )
-                    logging.info("Waiting for search list to appear")
-                    WebDriverWait(self.driver, timeout=10).until(
-                        lambda d: "display: none"
-                        not in (search_list.get_attribute("style") or "").lower()
-                    )
-
-                    logging.info("Grab first search result")
-                    first_result = search_list.find_element(By.XPATH, ".//li[1]//a")
-                    logging.info(
-                        "Filtering, normalizing, trim and lowercasing result text"
+                        f'ul[data-input-id="{label["inputId"]}"]',
                     )
-                    text: str = self.driver.execute_script(
-                        "return Array.from(arguments[0].childNodes)"
-                        ".filter(n => n.nodeType === Node.TEXT_NODE)"
-                        ".map(n => n.textContent)"
-                        ".join('').trim().toLowerCase();",
-                        first_result,
+                    logging.info("Waiting for first search result")
+                    first_result, text = WebDriverWait(self.driver, timeout=10).until(
+                        lambda d: d.execute_script(
+                            first_label_result_script, search_list
+                        )
                     )
 
                     logging.info("Checking if matching label")
-                    pre_entered_text = search_input.get_attribute("value")
-                    if pre_entered_text is not None:
-                        pre_entered_text = pre_entered_text.strip().lower()
-                        if text and text == pre_entered_text:
-                            logging.info("Found matching label, selecting it")
-                            first_result.click()
-                        else:
-                            logging.info("No matching label found")
-                            if self.manual_label_selection:
-                                logging.info("Manual label fixing needed")
-                                chime.info()
-                                input(
-                                    "!!! Please check the label manually and then press enter."
-                                )
-                            else:
-                                logging.info("Automatically removing label entry")
-                                remove_label_list[i].click()
-                        logging.info("Label errors fixed")
+                    text = text.strip().lower()
+                    pre_entered_text = pre_entered_text.strip().lower()
+                    if text and text == pre_entered_text:
+                        logging.info("Found matching label, selecting it")
+                        first_result.click()
                     else:
-                        logging.info("Pre-entered label text is empty, cannot match")
+                        logging.info("No matching label found")
+                        if self.manual_label_selection:
+                            logging.info("Manual label fixing needed")
+                            chime.info()
+                            input(
+                                "!!! Please check the label manually and then press enter."
+                            )
+                        elif label["removeButton"] is not None:
+                            logging.info("Automatically removing label entry")
+                            label["removeButton"].click()
+                    logging.info("Label errors fixed")
             else:
                 logging.info("Unknown error type, manual intervention required")
+                if not self.interactive:
+                    logging.warning("Cannot fix unknown error unattended, skipping")
+                    self.driver.close()
+                    return False
                 chime.info()
                 input(
                     "!!! An error was detected that cannot be automatically fixed. Please take care of it manually and then press enter."
@@ -351,7 +484,7 @@ class HarmonyDriver:
 
         logging.info("Publish release")
         edit_note_button.click()
-        enter_edit = self.wait_find_element(By.ID, "enter-edit")
+        enter_edit = self.wait_find_element(By.ID, "enter-edit", 2)
         enter_edit.click()
 
         logging.info("Waiting for publish to complete")
@@ -369,20 +502,21 @@ class HarmonyDriver:
             magicISRC_button = self.wait_find_element(
                 By.XPATH,
                 "//a[contains(normalize-space(.), 'Open with MagicISRC')]",
+                2,
             )
             _, _ = self.open_in_new_tab(magicISRC_button)
 
             logging.info("Check if need to login")
             # Wait for a button to load so we know the page is ready
             self.wait_find_element(By.ID, "check-isrcs-submit")
-            page_text = self.wait_find_element(By.TAG_NAME, "body").text
+            login_buttons = self.driver.find_elements(
+                By.XPATH,
+                "//button[@type='button' and normalize-space() = 'Login to MusicBrainz']",
+            )
             new_login = False
-            if "Login to MusicBrainz" in page_text:
+            if login_buttons:
                 logging.info("Logging in to MusicBrainz")
-                self.wait_find_element(
-                    By.XPATH,
-                    "//button[@type='button' and normalize-space() = 'Login to MusicBrainz']",
-                ).click()
+                login_buttons[0].click()
 
                 logging.info("Accepting access")
                 self.wait_find_element(
@@ -403,8 +537,8 @@ class HarmonyDriver:
                 "edit-submit",
             )
             if new_login:
-                logging.info("Saving Firefox profile after login to MagicISRC")
-                self.save_profile()
+                logging.info("Saving cookies after login to MagicISRC")
+                self.save_cookies()
 
             submit_button.click()
             logging.info("Waiting for ISRC submission to complete")
@@ -419,71 +553,103 @@ class HarmonyDriver:
         self.driver.close()
         self.driver.switch_to.window(self.processing_tab)
 
-    def process_external_links_to_tracks(self):
+    def process_external_links_to_tracks(self, max_tabs: int = 4):
         logging.info("Finding track external ID links")
         track_id_links = self.wait_find_elements(
             By.XPATH,
             "//a[contains(normalize-space(.), 'Link external IDs')]",
+            2,
         )
         logging.info(f"Found {len(track_id_links)} track external ID links to process.")
-        for link in track_id_links:
-            logging.info("Opening track external ID link in new tab")
-            _, _ = self.open_in_new_tab(link)
-            logging.info("Submitting track external ID")
-            self.wait_find_element(
-                By.XPATH,
-                "//button[@type='submit' and normalize-space() = 'Enter edit']",
-                30,
-            ).click()
-            logging.info("Waiting for submission to complete")
-            self.wait_find_element(
-                By.CLASS_NAME,
-                "banner",
-                120,
-            )
-            logging.info("Submission complete, closing tab")
-            self.driver.close()
-            self.driver.switch_to.window(self.processing_tab)
+        submit_locator = (
+            By.XPATH,
+            "//button[@type='submit' and normalize-space() = 'Enter edit']",
+        )
+        banner_locator = (By.CLASS_NAME, "banner")
+
+        # The track edits are independent, so keep several tabs in flight and
+        # poll them in turn. Each tab maps to (submitted, deadline).
+        pending = list(track_id_links)
+        in_flight: dict[str, tuple[bool, float]] = {}
+        while pending or in_flight:
+            while pending and len(in_flight) < max_tabs:
+                self.driver.switch_to.window(self.processing_tab)
+                logging.info("Opening track external ID link in new tab")
+                _, handle = self.open_in_new_tab(pending.pop(0))
+                in_flight[handle] = (False, time.monotonic() + 30)
+
+            for handle, (submitted, deadline) in list(in_flight.items()):
+                self.driver.switch_to.window(handle)
+                locator = banner_locator if submitted else submit_locator
+                try:
+                    element = WebDriverWait(self.driver, 1).until(
+                        EC.presence_of_element_located(locator)
+                    )
+                except TimeoutException:
+                    if time.monotonic() < deadline:
+                        continue
+                    element = self.wait_find_element(*locator)
+
+                if submitted:
+                    logging.info("Submission complete, closing tab")
+                    self.driver.close()
+                    del in_flight[handle]
+                else:
+                    logging.info("Submitting track external ID")
+                    element.click()
+                    in_flight[handle] = (True, time.monotonic() + 120)
+
+        self.driver.switch_to.window(self.processing_tab)
 
     def process_cover_art(self):
         # Get and set cover art
         logging.info("Finding cover art candidates")
-        cover_arts = self.wait_find_elements(By.CSS_SELECTOR, "figure.cover-image")
+        cover_arts = self.wait_find_elements(By.CSS_SELECTOR, "figure.cover-image", 2)
         logging.info(f"Found {len(cover_arts)} cover art candidates.")
-        best_overall = None  # tuple (area, width, height, data, src_url)
+        urls: list[str] = []
         for cover in cover_arts:
-            urls = self.candidate_urls_from_cover(cover)
-            for url in urls:
-                try:
-                    w, h, data = self.get_image_size_from_url(url)
-                except Exception:
-                    continue
-                area = w * h
-                if (best_overall is None) or (area > best_overall[0]):
-                    best_overall = (area, w, h, data, url)
-
-        if best_overall is None:
-            raise SystemExit("No valid images found")
-
-        logging.info("Found best cover art")
-        area, w, h, data, src_url = best_overall
-
-        logging.info("Extract filename from url")
-        cover_out_path = os.path.join(cover_folder, self.filename_from_url(src_url))
-        _, file_extension = os.path.splitext(cover_out_path)
-        if file_extension == "":
-            logging.info("No file extension found, defaulting to .jpg")
-            cover_out_path += ".jpg"
-        logging.info(f"Saving cover art to {cover_out_path}")
-        with open(cover_out_path, "wb") as f:
-            f.write(data)
-        logging.info(
-            f"Selected cover art from {src_url} with size {w}x{h}, saved to {cover_out_path}"
+            url = self.candidate_url_from_cover(cover)
+            if url and url not in urls:
+                urls.append(url)
+
+        # Only the image headers are fetched to compare sizes
+        logging.info(f"Probing {len(urls)} cover art URLs")
+        sizes: dict[str, tuple[int, int]] = {}
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for url, size in zip(urls, executor.map(self.probe_image_size, urls)):
+                if size is not None:
+                    sizes[url] = size
+
+        # Largest first, so a failed download falls back to the next best
+        candidates = sorted(
+            sizes.items(), key=lambda item: item[1][0] * item[1][1], reverse=True
         )
+        cover_out_path = None
+        for src_url, (w, h) in candidates:
+            logging.info("Extract filename from url")
+            out_path = os.path.join(cover_folder, self.filename_from_url(src_url))
+            _, file_extension = os.path.splitext(out_path)
+            if file_extension == "":
+                logging.info("No file extension found, defaulting to .jpg")
+                out_path += ".jpg"
+            logging.info(f"Downloading cover art from {src_url} to {out_path}")
+            try:
+                self.download_image(src_url, out_path)
+            except Exception:
+                logging.exception(f"Failed to download cover art from {src_url}")
+                continue
+            cover_out_path = out_path
+            logging.info(
+                f"Selected cover art from {src_url} with size {w}x{h}, saved to {cover_out_path}"
+            )
+            break
+
+        if cover_out_path is None:
+            raise RuntimeError("No valid images found")
 
         logging.info("Open cover art submission page")
         add_cover_button = self.wait_find_element(
-            By.XPATH, "//a[normalize-space() = 'Add cover art']"
+            By.XPATH, "//a[normalize-space() = 'Add cover art']", 2
         )
         _, _ = self.open_in_new_tab(add_cover_button)
 
@@ -498,10 +664,10 @@ class HarmonyDriver:
         cover_art_link = self.wait_find_element(
             By.XPATH,
             "//a[contains(@href, '/cover-art')]/bdi",
-            10,
+            2,
         )
         text = cover_art_link.text
-        match = re.search(r"Cover art \((\d+)\)", text)
+        match = cover_art_count_pattern.search(text)
         if match:
             count = int(match.group(1))
             if count > 0:
@@ -535,6 +701,23 @@ class HarmonyDriver:
 
     ## Helper functions ##
 
+    def close_tabs_except_harmony(self):
+        handles = self.driver.window_handles
+        # Keep one tab open so the browser session survives
+        keep = self.harmony_tab if self.harmony_tab in handles else handles[0]
+        for handle in handles:
+            if handle != keep:
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+        self.driver.switch_to.window(keep)
+        self.harmony_tab = keep
+
+    def ask(self, prompt: str, default: str) -> str:
+        if self.interactive:
+            return input(prompt).strip().lower()
+        logging.warning(f"Unattended run, answering '{default}' to: {prompt}")
+        return default
+
     def wait_find_element(
         self, by: str, identifier: str, timeout: int = 10
     ) -> WebElement:
@@ -544,12 +727,9 @@ class HarmonyDriver:
                     EC.presence_of_element_located((by, identifier))
                 )
             except TimeoutException:
-                user_input = (
-                    input(
-                        f"Timeout waiting for element ({by}: {identifier}). Press 'r' to retry or 'c' to continue (may raise exception): "
-                    )
-                    .strip()
-                    .lower()
+                user_input = self.ask(
+                    f"Timeout waiting for element ({by}: {identifier}). Press 'r' to retry or 'c' to continue (may raise exception): ",
+                    "c",
                 )
                 if user_input != "r":
                     raise
@@ -577,16 +757,20 @@ class HarmonyDriver:
         before = set(self.driver.window_handles)
 
         logging.info("Opening link in new tab...")
-        elem = self.wait_find_clickable(click_locator)
-        elem.send_keys(Keys.CONTROL + Keys.ENTER)
+        href = click_locator.get_attribute("href")
+        if href:
+            # Links are opened directly, without relying on a synthetic keystroke
+            self.driver.execute_script("window.open(arguments[0], '_blank');", href)
+        else:
+            # Submit buttons have to go through their form
+            elem = self.wait_find_clickable(click_locator)
+            elem.send_keys(Keys.CONTROL + Keys.ENTER)
 
         # Wait for a new window handle to appear
         logging.info("Waiting for new tab to open...")
-        WebDriverWait(self.driver, timeout).until(
-            lambda d: len(set(d.window_handles) - before) > 0
+        new_handles = WebDriverWait(self.driver, timeout).until(
+            lambda d: set(d.window_handles) - before
         )
-        after = set(self.driver.window_handles)
-        new_handles = after - before
         new_handle = new_handles.pop()
 
         logging.info("Switching to new tab...")
@@ -595,47 +779,156 @@ class HarmonyDriver:
         logging.info("Returning handles...")
         return original_handle, new_handle
 
-    def candidate_urls_from_cover(self, cover: WebElement):
-        # prefer the anchor href (likely high-res) plus the img src as fallback
-        urls: list[str] = []
-        try:
-            a = cover.find_element(By.CSS_SELECTOR, "a")
-            href = a.get_attribute("href")
+    def candidate_url_from_cover(self, cover: WebElement) -> str | None:
+        # the anchor href is the high-res image, the img src is only a fallback
+        # find_elements returns immediately when nothing matches
+        anchors = cover.find_elements(By.CSS_SELECTOR, "a")
+        if anchors:
+            href = anchors[0].get_attribute("href")
             if href:
-                urls.append(href)
+                return href
+        images = cover.find_elements(By.CSS_SELECTOR, "img")
+        if images:
+            return images[0].get_attribute("src") or None
+        return None
+
+    def probe_image_size(
+        self,
+        url: str,
+        timeout: float = 20,
+        chunk_size: int = 8192,
+        probe_size: int = 65536,
+    ) -> tuple[int, int] | None:
+        # Only request the start of the image at first. Headers that don't fit
+        # in it, like JPEGs with large metadata, fall back to a full streamed
+        # read that still stops once the header is parsed
+        size, partial = self.stream_image_size(url, timeout, chunk_size, probe_size)
+        if size is None and partial:
+            size, _ = self.stream_image_size(url, timeout, chunk_size)
+        return size
+
+    def stream_image_size(
+        self,
+        url: str,
+        timeout: float,
+        chunk_size: int,
+        probe_size: int | None = None,
+    ) -> tuple[tuple[int, int] | None, bool]:
+        # Returns the image size if found and whether the response was partial
+        headers = dict(self.http.headers)
+        if probe_size is not None:
+            headers["Range"] = f"bytes=0-{probe_size - 1}"
+        parser = ImageFile.Parser()
+        head = b""
+        size = None
+        try:
+            response = self.http.request(
+                "GET",
+                url,
+                headers=headers,
+                preload_content=False,
+                timeout=timeout,
+            )
         except Exception:
-            pass
+            return None, False
+        partial = response.status == 206
         try:
-            img = cover.find_element(By.CSS_SELECTOR, "img")
-            src = img.get_attribute("src")
-            if src and src not in urls:
-                urls.append(src)
+            if response.status < 400:
+                for chunk in response.stream(chunk_size):
+                    # PIL only sizes a WebP once it has the whole file, so its
+                    # header is read directly
+                    head = (head + chunk)[:30]
+                    size = self.webp_size(head)
+                    if size is not None:
+                        break
+                    parser.feed(chunk)
+                    if parser.image is not None:
+                        size = parser.image.size
+                        break
         except Exception:
-            pass
-        return urls
+            return None, False
+        finally:
+            if partial:
+                # The rest of a partial response is small, read it so the
+                # connection can be reused
+                response.drain_conn()
+            else:
+                response.close()
+            response.release_conn()
+        return size, partial
+
+    def webp_size(self, head: bytes) -> tuple[int, int] | None:
+        # Reads the canvas size from the first 30 bytes of a WebP file
+        if len(head) < 30 or head[:4] != b"RIFF" or head[8:12] != b"WEBP":
+            return None
+        chunk = head[12:16]
+        if chunk == b"VP8X":
+            width = int.from_bytes(head[24:27], "little") + 1
+            height = int.from_bytes(head[27:30], "little") + 1
+        elif chunk == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+            width = int.from_bytes(head[26:28], "little") & 0x3FFF
+            height = int.from_bytes(head[28:30], "little") & 0x3FFF
+        elif chunk == b"VP8L" and head[20] == 0x2F:
+            bits = int.from_bytes(head[21:25], "little")
+            width = (bits & 0x3FFF) + 1
+            height = ((bits >> 14) & 0x3FFF) + 1
+        else:
+            return None
+        return width, height
 
-    def get_image_size_from_url(self, url: str, timeout: float = 20):
-        with urlopen(url, timeout=timeout) as response:
-            data = response.read()
-        img = Image.open(BytesIO(data))
-        img.verify()
-        img = Image.open(BytesIO(data))
-        return img.width, img.height, data
+    def download_image(self, url: str, path: str, timeout: float = 20):
+        # Stream straight to disk rather than holding the image in memory
+        response = self.http.request("GET", url, preload_content=False, timeout=timeout)
+        try:
+            if response.status >= 400:
+                # Don't hand a connection with an unread body back to the pool
+                response.close()
+                raise OSError(f"Failed to download {url}: HTTP {response.status}")
+            try:
+                with open(path, "wb") as f:
+                    shutil.copyfileobj(response, f, length=64 * 1024)
+            except BaseException:
+                # Neither the half-read connection nor a partially written
+                # image should be left behind
+                response.close()
+                if os.path.exists(path):
+                    os.remove(path)
+                raise
+        finally:
+            response.release_conn()
 
     def filename_from_url(self, url: str) -> str:
         path = urlparse(url).path
         name = os.path.basename(unquote(path)) or "image"
         return name
 
-    def save_profile(self):
-        profile = self.driver.capabilities["moz:profile"]
-        logging.info(f"Saving Firefox profile {profile} to {ff_profile_folder}")
-        shutil.rmtree(ff_profile_folder)
-        shutil.copytree(
-            profile,
-            ff_profile_folder,
-            ignore=shutil.ignore_patterns("parent.lock", "lock", ".parentlock"),
-        )
+    def read_cookies(self) -> list[dict]:
+        if not os.path.isfile(cookie_file_path):
+            return []
+        with open(cookie_file_path, "r") as f:
+            return json.load(f)
+
+    def load_cookies(self):
+        now = time.time()
+        cookies = [c for c in self.read_cookies() if c.get("expiry", now) >= now]
+        if not cookies:
+            return
+        logging.info(f"Loading {len(cookies)} saved cookies from {cookie_file_path}")
+        # Cookies can only be added for the domain currently loaded
+        for domain in {c["domain"].lstrip(".") for c in cookies}:
+            self.driver.get(f"https://{domain}/robots.txt")
+            for cookie in cookies:
+                if cookie["domain"].lstrip(".") == domain:
+                    self.driver.add_cookie(cookie)
+
+    def save_cookies(self):
+        # Merge the cookies of the current site into the saved ones
+        cookies = {(c["domain"], c["name"]): c for c in self.read_cookies()}
+        for cookie in self.driver.get_cookies():
+            cookies[(cookie["domain"], cookie["name"])] = cookie
+        logging.info(f"Saving {len(cookies)} cookies to {cookie_file_path}")
+        with open(cookie_file_path, "w") as f:
+            json.dump(list(cookies.values()), f, indent=2)
 
     def modify_musicbrainz_links(self):
         self.driver.execute_script(r"""
@@ -1,4 +1,5 @@
 import argparse
+import os
 from harmony_driver import HarmonyDriver
 
 if __name__ == "__main__":
@@ -10,6 +11,7 @@ if __name__ == "__main__":
         copy_id: bool
         manual_labels: bool
         use_test_mb: bool
+        headless: bool
         urls: list[str] | None
         urls_file: str | None
 
@@ -35,7 +37,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--manual-review",
         default=True,
-        action="store_true",
+        action=argparse.BooleanOptionalAction,
         help="Require manual review before publishing releases",
     )
     parser.add_argument(
@@ -53,7 +55,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--manual-labels",
         default=True,
-        action="store_true",
+        action=argparse.BooleanOptionalAction,
         help="Enable manual label selection for error fixing",
     )
     parser.add_argument(
@@ -62,9 +64,27 @@ if __name__ == "__main__":
         action="store_true",
         help="Use the MusicBrainz test server for imports",
     )
+    parser.add_argument(
+        "--headless",
+        default=False,
+        action="store_true",
+        help="Run Firefox without a visible window",
+    )
 
     args = parser.parse_args(namespace=DefVal)
 
+    if args.headless and (args.manual_review or args.manual_labels):
+        parser.error(
+            "--headless requires --no-manual-review and --no-manual-labels, "
+            "as both need to look at the browser."
+        )
+    # The .env file is loaded when harmony_driver is imported
+    if args.headless and not (os.getenv("mb_user") and os.getenv("mb_pass")):
+        parser.error(
+            "--headless requires mb_user and mb_pass to be set in .env, "
+            "as logging in manually needs the browser."
+        )
+
     song_urls = []
     if args.urls:
         song_urls.extend(args.urls)
@@ -85,6 +105,7 @@ if __name__ == "__main__":
         manual_label_selection=args.manual_labels,
         use_test_mb=args.use_test_mb,
         song_urls=song_urls,
+        headless=args.headless,
     )
 
     driver.process()